@@ -1,24 +1,199 @@
-from flask import Flask, render_template, request, jsonify, session, make_response
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+import orjson
 import os
 from dotenv import load_dotenv
 from backend.core.session import LearningSession
+from backend.core.session_store import load_session, save_session, iter_local_sessions, using_redis, SESSION_TTL
 from backend.api.perplexity import PerplexityClient
 import backend.utils.database as db
 from backend.utils.quiz_generator import QuizGenerator
-import json
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from secrets import token_urlsafe
+import atexit
+import hashlib
+import re
+import threading
+import time
 
 load_dotenv()
 
-app = Flask(__name__, 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson's C serializer.
+
+    Every endpoint responds through jsonify, so swapping the provider
+    speeds up serialization across the board with no call-site changes.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app = Flask(__name__,
             template_folder='frontend/templates',
             static_folder='frontend/static')
 app.secret_key = os.getenv('SECRET_KEY', os.urandom(24))
+app.json = OrjsonProvider(app)
+
+# Compress text-heavy responses (exported handbooks shrink ~6x)
+app.config.update(
+    COMPRESS_MIMETYPES=['application/json', 'text/markdown', 'text/html'],
+    COMPRESS_LEVEL=6,
+    COMPRESS_MIN_SIZE=500
+)
+Compress(app)
 
-# Store sessions in memory
-sessions = {}
 quiz_gen = QuizGenerator()
 perplexity_client = PerplexityClient()
 
+# Short-lived caches for the read-heavy polling endpoints, keyed on the
+# topics version counter so any topic write invalidates them immediately.
+# cachetools caches are not thread-safe, so every access goes through the
+# lock (the payloads are small enough to hold it across the recompute)
+_topics_cache = TTLCache(maxsize=8, ttl=30)
+_stats_cache = TTLCache(maxsize=8, ttl=30)
+_cache_lock = threading.Lock()
+
+# Resource lookups keyed on (topic, step title) only, since the prompt
+# around them never changes; repeat lookups skip Perplexity entirely.
+# Written from the prefetch pool as well as request threads, so all
+# access goes through the lock
+_resources_cache = TTLCache(maxsize=256, ttl=3600)
+_resources_lock = threading.Lock()
+
+# Shared keyword args for the session cookies, built once at import
+SESSION_COOKIE_KW = dict(httponly=True, samesite='Lax', max_age=86400)
+
+# Matches an optionally ```json-tagged fenced block in one linear scan
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+PERSONA_STYLES = {
+    "General": "helpful and clear",
+    "Scientist": "academic, precise, and highly technical",
+    "ELI5": "extremely simple, using analogies that a 5-year-old would understand",
+    "Socratic": "inquisitive, answering with questions that guide the user to discover the answer themselves"
+}
+
+# Chat prompt built once at import; chat() fills in the per-request
+# fields instead of re-parsing a multi-line f-string every call
+CHAT_PROMPT = """You are a {persona} learning assistant. Your teaching style is {style}.
+The user is currently learning about:
+Topic: {topic}
+Difficulty: {difficulty}
+Current Step: {step_title}
+
+User question: {message}
+
+Provide a clear, helpful answer in your assigned style ({style}) that relates to their current learning step.""".format
+
+# Background pool for warming the guide/quiz/resources of a freshly
+# entered step; futures are kept per session (they can't be pickled, so
+# they live here rather than on the LearningSession itself) and expire
+# on the same schedule as the sessions they belong to
+executor = ThreadPoolExecutor(max_workers=4)
+_prefetch = TTLCache(maxsize=10_000, ttl=SESSION_TTL)
+_prefetch_lock = threading.Lock()
+
+def _conditional_json(payload):
+    """jsonify with an ETag, answering 304 when If-None-Match matches.
+
+    The polled GET endpoints almost always return the same payload, so
+    matching clients skip the body (and its serialization) entirely.
+    """
+    etag = hashlib.blake2s(orjson.dumps(payload)).hexdigest()
+    if request.if_none_match.contains(etag):
+        return '', 304
+    resp = jsonify(payload)
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
+
+def _fetch_resources(topic, step_title):
+    """Ask Perplexity for learning resources for a step and parse the JSON"""
+    with _resources_lock:
+        cached = _resources_cache.get((topic, step_title))
+    if cached is not None:
+        return cached
+
+    prompt = f"""Find 3 highly relevant learning resources (articles, videos, or courses) for someone learning about "{step_title}" in the context of "{topic}".
+    Return only a JSON list of objects, each with 'title', 'type' (Article, Video, or Course), and 'url'.
+    No other text."""
+
+    messages = [{"role": "user", "content": prompt}]
+    response = perplexity_client.chat_completion(messages)
+    ai_response = response['choices'][0]['message']['content']
+
+    # Extract JSON from response if there's any markdown wrapping
+    match = FENCE_RE.search(ai_response)
+    payload = match.group(1) if match else ai_response
+    resources = orjson.loads(payload)
+    with _resources_lock:
+        _resources_cache[(topic, step_title)] = resources
+    return resources
+
+def _warm_guide(learning_session):
+    return learning_session.get_detailed_guide_for_step()
+
+def _warm_quiz(learning_session):
+    current_step = learning_session.get_current_step()
+    step_details = '\n'.join(current_step['details']) if current_step['details'] else current_step['title']
+    return quiz_gen.generate_quiz(learning_session.roadmap.topic, current_step['title'], step_details)
+
+def _warm_resources(learning_session):
+    current_step = learning_session.get_current_step()
+    return _fetch_resources(learning_session.roadmap.topic, current_step['title'])
+
+def _prefetch_step(session_id, learning_session):
+    """Warm the guide, quiz and resources for the session's current step.
+
+    Users almost always ask for these right after advancing, so the
+    Perplexity calls are kicked off in the background and the endpoints
+    pick up the finished futures instead of blocking on the API.
+    """
+    current_step = learning_session.get_current_step()
+    entry = {
+        'topic': learning_session.roadmap.topic,
+        'step_title': current_step['title'],
+        'guide': executor.submit(_warm_guide, learning_session),
+        'quiz': executor.submit(_warm_quiz, learning_session),
+        'resources': executor.submit(_warm_resources, learning_session),
+    }
+    with _prefetch_lock:
+        _prefetch[session_id] = entry
+
+def _flush_dirty_progress():
+    """Write out progress that next_step() has coalesced but not yet flushed"""
+    rows = [
+        (ls.current_step_index, ls.topic_id)
+        for ls in iter_local_sessions()
+        if ls.topic_id is not None and ls.current_step_index != ls._last_flushed_index
+    ]
+    if rows:
+        db.update_topics_progress_many(rows)
+
+atexit.register(_flush_dirty_progress)
+
+def _prefetched(session_id, kind, topic, step_title):
+    """Return a finished prefetch result for this session, or None.
+
+    Results warmed for a different topic or step are ignored, so a user
+    who starts a new topic or advances again never sees stale content.
+    """
+    with _prefetch_lock:
+        entry = _prefetch.get(session_id)
+    if not entry or entry['topic'] != topic or entry['step_title'] != step_title:
+        return None
+    future = entry.get(kind)
+    if future is not None and future.done():
+        try:
+            return future.result()
+        except Exception:
+            return None
+    return None
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -33,13 +208,15 @@ def start_topic():
     if not topic:
         return jsonify({'error': 'Topic is required'}), 400
     
-    session_id = request.cookies.get('session_id', os.urandom(16).hex())
+    session_id = request.cookies.get('session_id') or token_urlsafe(16)
     learning_session = LearningSession(persona=persona, difficulty=difficulty)
     
     try:
         roadmap = learning_session.start_new_topic(topic)
-        sessions[session_id] = learning_session
-        
+        # Drop anything warmed for the session's previous topic
+        with _prefetch_lock:
+            _prefetch.pop(session_id, None)
+
         steps = [
             {
                 'number': step['number'],
@@ -52,7 +229,9 @@ def start_topic():
         # Save to database
         roadmap_data = {'topic': topic, 'steps': steps, 'persona': persona, 'difficulty': difficulty}
         topic_id = db.save_topic(topic, roadmap_data, len(steps))
-        
+        learning_session.topic_id = topic_id
+        save_session(session_id, learning_session)
+
         response = jsonify({
             'success': True,
             'topic': topic,
@@ -60,8 +239,8 @@ def start_topic():
             'steps': steps,
             'currentStep': 0
         })
-        response.set_cookie('session_id', session_id)
-        response.set_cookie('topic_id', str(topic_id))
+        response.set_cookie('session_id', session_id, **SESSION_COOKIE_KW)
+        response.set_cookie('topic_id', str(topic_id), **SESSION_COOKIE_KW)
         return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -70,13 +249,18 @@ def start_topic():
 def get_guide():
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
     try:
-        guide = learning_session.get_detailed_guide_for_step()
+        current_step = learning_session.get_current_step()
+        guide = None
+        if current_step:
+            guide = _prefetched(session_id, 'guide',
+                                learning_session.roadmap.topic, current_step['title'])
+        if guide is None:
+            guide = learning_session.get_detailed_guide_for_step()
         return jsonify({
             'success': True,
             'guide': guide
@@ -89,17 +273,30 @@ def next_step():
     session_id = request.cookies.get('session_id')
     topic_id = request.cookies.get('topic_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
-    
-    learning_session = sessions[session_id]
     step = learning_session.next_step()
-    
-    # Update progress in database
+
+    # Coalesce progress writes: rapid clicking only hits the database
+    # every 2 seconds or every 3 steps, whichever comes first; the final
+    # step always flushes so completion is never lost. Only the local
+    # store can recover dirty progress on eviction, so Redis-backed
+    # sessions write through every time.
     if topic_id:
-        db.update_topic_progress(int(topic_id), learning_session.current_step_index)
-    
+        now = time.time()
+        if (step is None
+                or using_redis()
+                or now - learning_session._last_flush > 2.0
+                or learning_session.current_step_index - learning_session._last_flushed_index >= 3):
+            db.update_topic_progress(int(topic_id), learning_session.current_step_index)
+            learning_session._last_flush = now
+            learning_session._last_flushed_index = learning_session.current_step_index
+
+    save_session(session_id, learning_session)
+
     if step:
+        _prefetch_step(session_id, learning_session)
         return jsonify({
             'success': True,
             'step': {
@@ -127,40 +324,51 @@ def chat():
     if not message:
         return jsonify({'error': 'Message is required'}), 400
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
-    
-    learning_session = sessions[session_id]
     current_step = learning_session.get_current_step()
     
     try:
-        persona_styles = {
-            "General": "helpful and clear",
-            "Scientist": "academic, precise, and highly technical",
-            "ELI5": "extremely simple, using analogies that a 5-year-old would understand",
-            "Socratic": "inquisitive, answering with questions that guide the user to discover the answer themselves"
-        }
-        style = persona_styles.get(learning_session.persona, "helpful")
-        
-        # Build context-aware prompt
-        context = f"""You are a {learning_session.persona} learning assistant. Your teaching style is {style}.
-The user is currently learning about:
-Topic: {learning_session.roadmap.topic}
-Difficulty: {learning_session.difficulty}
-Current Step: {current_step['title']}
+        style = PERSONA_STYLES.get(learning_session.persona, "helpful")
 
-User question: {message}
+        # Build context-aware prompt
+        context = CHAT_PROMPT(
+            persona=learning_session.persona,
+            style=style,
+            topic=learning_session.roadmap.topic,
+            difficulty=learning_session.difficulty,
+            step_title=current_step['title'],
+            message=message
+        )
 
-Provide a clear, helpful answer in your assigned style ({style}) that relates to their current learning step."""
-        
         messages = [{"role": "user", "content": context}]
+
+        # Optionally stream the answer as Server-Sent Events so the
+        # worker isn't blocked for the whole Perplexity round-trip
+        if data.get('stream'):
+            if topic_id:
+                db.save_chat_message(int(topic_id), learning_session.current_step_index, 'user', message)
+
+            def generate():
+                parts = []
+                for delta in perplexity_client.chat_completion_stream(messages):
+                    parts.append(delta)
+                    yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+                if topic_id:
+                    db.save_chat_message(int(topic_id), learning_session.current_step_index,
+                                         'assistant', ''.join(parts))
+                yield "data: [DONE]\n\n"
+
+            return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
         response = perplexity_client.chat_completion(messages)
         ai_response = response['choices'][0]['message']['content']
         
-        # Save to database
+        # Save both messages in one batched insert
         if topic_id:
-            db.save_chat_message(int(topic_id), learning_session.current_step_index, 'user', message)
-            db.save_chat_message(int(topic_id), learning_session.current_step_index, 'assistant', ai_response)
+            db.save_chat_messages(int(topic_id), learning_session.current_step_index,
+                                  [('user', message), ('assistant', ai_response)])
         
         return jsonify({
             'success': True,
@@ -174,20 +382,22 @@ def generate_quiz():
     """Generate a quiz for the current step"""
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
-    
-    learning_session = sessions[session_id]
     current_step = learning_session.get_current_step()
     
     try:
-        step_details = '\n'.join(current_step['details']) if current_step['details'] else current_step['title']
-        questions = quiz_gen.generate_quiz(
-            learning_session.roadmap.topic,
-            current_step['title'],
-            step_details
-        )
-        
+        questions = _prefetched(session_id, 'quiz',
+                                learning_session.roadmap.topic, current_step['title'])
+        if questions is None:
+            step_details = '\n'.join(current_step['details']) if current_step['details'] else current_step['title']
+            questions = quiz_gen.generate_quiz(
+                learning_session.roadmap.topic,
+                current_step['title'],
+                step_details
+            )
+
         return jsonify({
             'success': True,
             'questions': questions
@@ -204,29 +414,25 @@ def submit_quiz():
     topic_id = request.cookies.get('topic_id')
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
-    # Calculate score
-    correct = 0
-    results = []
-    
-    for i, question in enumerate(questions):
-        user_answer = answers.get(str(i))
-        is_correct = quiz_gen.check_answer(question, user_answer) if user_answer else False
-        
-        if is_correct:
-            correct += 1
-        
-        results.append({
+    # Grade the whole quiz in one batch
+    user_answers = [answers.get(str(i)) for i in range(len(questions))]
+    corrects = quiz_gen.check_answers_batch(questions, user_answers)
+    correct = sum(corrects)
+
+    results = [
+        {
             'question_number': i + 1,
             'correct': is_correct,
-            'user_answer': user_answer,
-            'correct_answer': question['correct']
-        })
-    
+            'user_answer': user_answers[i],
+            'correct_answer': questions[i]['correct']
+        }
+        for i, is_correct in enumerate(corrects)
+    ]
+
     # Save to database
     if topic_id:
         db.save_quiz_result(int(topic_id), learning_session.current_step_index, correct, len(questions))
@@ -235,7 +441,8 @@ def submit_quiz():
         'success': True,
         'score': correct,
         'total': len(questions),
-        'percentage': round((correct / len(questions)) * 100) if questions else 0,
+        # Integer arithmetic (half rounds up) avoids the float division and round()
+        'percentage': (100 * correct + len(questions) // 2) // len(questions) if questions else 0,
         'results': results
     })
 
@@ -250,11 +457,10 @@ def save_note():
     if not content:
         return jsonify({'error': 'Content is required'}), 400
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
     if topic_id:
         db.save_note(int(topic_id), learning_session.current_step_index, content)
     
@@ -266,40 +472,52 @@ def get_note():
     topic_id = request.cookies.get('topic_id')
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
     if topic_id:
         note = db.get_note(int(topic_id), learning_session.current_step_index)
-        return jsonify({'success': True, 'note': note})
-    
-    return jsonify({'success': True, 'note': None})
+        return _conditional_json({'success': True, 'note': note})
+
+    return _conditional_json({'success': True, 'note': None})
 
 @app.route('/api/topics', methods=['GET'])
 def get_topics():
     """Get all topics"""
-    topics = db.get_all_topics()
-    return jsonify({'success': True, 'topics': topics})
+    version = db.topics_version()
+    with _cache_lock:
+        payload = _topics_cache.get(version)
+        if payload is None:
+            payload = {'success': True, 'topics': db.get_all_topics()}
+            _topics_cache[version] = payload
+    return _conditional_json(payload)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get learning statistics"""
-    topics = db.get_all_topics()
-    total_topics = len(topics)
-    completed_topics = len([t for t in topics if t['completed']])
-    
-    # Calculate total steps across all topics
-    total_steps = sum([t['total_steps'] for t in topics])
-    current_steps = sum([t['current_step'] + 1 for t in topics]) # +1 because current_step is 0-indexed
-    
-    return jsonify({
-        'success': True,
-        'totalTopics': total_topics,
-        'completedTopics': completed_topics,
-        'progress': round((current_steps / total_steps) * 100) if total_steps > 0 else 0
-    })
+    version = db.topics_version()
+    with _cache_lock:
+        payload = _stats_cache.get(version)
+        if payload is None:
+            topics = db.get_all_topics()
+            completed_topics = 0
+            total_steps = 0
+            current_steps = 0
+            for t in topics:
+                if t['completed']:
+                    completed_topics += 1
+                total_steps += t['total_steps']
+                current_steps += t['current_step'] + 1  # +1 because current_step is 0-indexed
+
+            payload = {
+                'success': True,
+                'totalTopics': len(topics),
+                'completedTopics': completed_topics,
+                'progress': (100 * current_steps + total_steps // 2) // total_steps if total_steps > 0 else 0
+            }
+            _stats_cache[version] = payload
+    return _conditional_json(payload)
 
 @app.route('/api/export', methods=['GET'])
 def export_handbook():
@@ -307,41 +525,45 @@ def export_handbook():
     topic_id = request.cookies.get('topic_id')
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return "No active session found.", 400
-    
-    learning_session = sessions[session_id]
-    topic_data = db.get_topic(int(topic_id))
-    
+
+    # One transaction fetches the topic plus every note and chat message
+    topic_data, notes, chats = db.get_export_bundle(int(topic_id))
+
     if not topic_data:
         return "Topic not found.", 404
-    
-    md_content = f"# Learning Handbook: {topic_data['name']}\n"
-    md_content += f"**Persona:** {learning_session.persona} | **Difficulty:** {learning_session.difficulty}\n\n"
-    md_content += "## Roadmap\n"
-    for i, step in enumerate(topic_data['roadmap_data']['steps']):
-        md_content += f"### Step {i+1}: {step['title']}\n"
-        for detail in step['details']:
-            md_content += f"- {detail}\n"
-        
-        # Add Note
-        note = db.get_note(int(topic_id), i)
-        if note:
-            md_content += f"\n#### My Notes\n> {note}\n"
-        
-        # Add Chat History
-        chat_history = db.get_chat_history(int(topic_id), i)
-        if chat_history:
-            md_content += f"\n#### Chat History\n"
-            for msg in chat_history:
-                md_content += f"**{msg['role'].capitalize()}:** {msg['message']}\n\n"
-        
-        md_content += "\n---\n"
-    
-    response = make_response(md_content)
-    response.headers["Content-Disposition"] = f"attachment; filename={topic_data['name'].replace(' ', '_')}_Handook.md"
-    response.headers["Content-Type"] = "text/markdown"
-    return response
+
+    # Stream the handbook chunk by chunk instead of concatenating one big
+    # string in memory first
+    def generate():
+        yield f"# Learning Handbook: {topic_data['name']}\n"
+        yield f"**Persona:** {learning_session.persona} | **Difficulty:** {learning_session.difficulty}\n\n"
+        yield "## Roadmap\n"
+        for i, step in enumerate(topic_data['roadmap_data']['steps']):
+            yield f"### Step {i+1}: {step['title']}\n"
+            for detail in step['details']:
+                yield f"- {detail}\n"
+
+            # Add Note
+            note = notes.get(i)
+            if note:
+                yield f"\n#### My Notes\n> {note}\n"
+
+            # Add Chat History
+            chat_history = chats.get(i, [])
+            if chat_history:
+                yield "\n#### Chat History\n"
+                for msg in chat_history:
+                    yield f"**{msg['role'].capitalize()}:** {msg['message']}\n\n"
+
+            yield "\n---\n"
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={topic_data['name'].replace(' ', '_')}_Handook.md"
+    }
+    return Response(stream_with_context(generate()), mimetype='text/markdown', headers=headers)
 
 @app.route('/api/chat-history', methods=['GET'])
 def get_chat_history():
@@ -349,16 +571,15 @@ def get_chat_history():
     topic_id = request.cookies.get('topic_id')
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
     if topic_id:
         history = db.get_chat_history(int(topic_id), learning_session.current_step_index)
-        return jsonify({'success': True, 'history': history})
-    
-    return jsonify({'success': True, 'history': []})
+        return _conditional_json({'success': True, 'history': history})
+
+    return _conditional_json({'success': True, 'history': []})
 
 @app.route('/api/get-resources', methods=['POST'])
 def get_resources():
@@ -371,22 +592,11 @@ def get_resources():
         return jsonify({'error': 'Topic and step title are required'}), 400
     
     try:
-        prompt = f"""Find 3 highly relevant learning resources (articles, videos, or courses) for someone learning about "{step_title}" in the context of "{topic}".
-        Return only a JSON list of objects, each with 'title', 'type' (Article, Video, or Course), and 'url'.
-        No other text."""
-        
-        messages = [{"role": "user", "content": prompt}]
-        response = perplexity_client.chat_completion(messages)
-        ai_response = response['choices'][0]['message']['content']
-        
-        # Extract JSON from response if there's any markdown wrapping
-        if "```json" in ai_response:
-            ai_response = ai_response.split("```json")[1].split("```")[0].strip()
-        elif "```" in ai_response:
-            ai_response = ai_response.split("```")[1].split("```")[0].strip()
-            
-        resources = json.loads(ai_response)
-        
+        session_id = request.cookies.get('session_id')
+        resources = _prefetched(session_id, 'resources', topic, step_title)
+        if resources is None:
+            resources = _fetch_resources(topic, step_title)
+
         return jsonify({
             'success': True,
             'resources': resources
@@ -406,11 +616,10 @@ def clear_chat():
     topic_id = request.cookies.get('topic_id')
     session_id = request.cookies.get('session_id')
     
-    if not session_id or session_id not in sessions:
+    learning_session = load_session(session_id) if session_id else None
+    if learning_session is None:
         return jsonify({'error': 'No active session'}), 400
     
-    learning_session = sessions[session_id]
-    
     if topic_id:
         db.clear_chat_history(int(topic_id), learning_session.current_step_index)
         return jsonify({'success': True})
@@ -418,7 +627,11 @@ def clear_chat():
     return jsonify({'error': 'No topic selected'}), 400
 
 if __name__ == '__main__':
+    # Werkzeug's dev server is single-threaded; production runs under
+    # gunicorn (see Dockerfile / render.yaml)
+    if os.getenv('FLASK_ENV', 'development') != 'development':
+        raise SystemExit('Refusing to run the dev server outside development; '
+                         'use gunicorn instead (see Dockerfile).')
     port = int(os.getenv('PORT', 5000))
     host = os.getenv('HOST', '0.0.0.0')
-    debug = os.getenv('FLASK_ENV', 'development') == 'development'
-    app.run(host=host, port=port, debug=debug)
+    app.run(host=host, port=port, debug=True)
@@ -1,6 +1,18 @@
 import os
 import requests
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# In-memory LRU of past completions keyed by a hash of the full request
+# payload. Identical prompts skip the network round-trip entirely.
+_CACHE_MAX_ENTRIES = 1024
+_response_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_key(payload):
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
 class PerplexityClient:
     def __init__(self, api_key=None, base_url="https://api.perplexity.ai"):
@@ -23,11 +35,55 @@ class PerplexityClient:
             "messages": messages,
             "temperature": temperature
         }
-        
+
+        key = _cache_key(payload)
+        with _cache_lock:
+            if key in _response_cache:
+                _response_cache.move_to_end(key)
+                return _response_cache[key]
+
         try:
             response = requests.post(url, headers=self.headers, json=payload)
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error calling Perplexity API: {e}")
+            raise
+
+        with _cache_lock:
+            _response_cache[key] = result
+            if len(_response_cache) > _CACHE_MAX_ENTRIES:
+                _response_cache.popitem(last=False)
+        return result
+
+    def chat_completion_stream(self, messages, model="sonar", temperature=0.2):
+        """
+        Stream a chat completion from the Perplexity API.
+
+        Yields content deltas as they arrive instead of blocking until
+        the full response is ready.
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True
+        }
+
+        try:
+            response = requests.post(url, headers=self.headers, json=payload, stream=True)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b'data: '):
+                    continue
+                data = line[len(b'data: '):]
+                if data == b'[DONE]':
+                    break
+                chunk = json.loads(data)
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
         except requests.exceptions.RequestException as e:
             print(f"Error calling Perplexity API: {e}")
             raise
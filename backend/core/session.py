@@ -8,6 +8,10 @@ class LearningSession:
         self.current_step_index = -1
         self.persona = persona
         self.difficulty = difficulty
+        self.topic_id = None
+        # Write-coalescing state for progress updates (see app.next_step)
+        self._last_flush = 0.0
+        self._last_flushed_index = -1
 
     def start_new_topic(self, topic):
         print(f"Generating {self.difficulty} roadmap for '{topic}'...")
@@ -0,0 +1,100 @@
+import os
+import pickle
+import threading
+
+from cachetools import Cache, TTLCache
+
+import backend.utils.database as db
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# How long an idle session survives before expiring
+SESSION_TTL = 3600
+
+_redis = None
+if os.getenv('REDIS_URL'):
+    if redis is None:
+        # Falling back silently would give multi-worker deployments
+        # non-shared in-memory sessions and random session losses
+        raise RuntimeError('REDIS_URL is set but the redis package is not '
+                           'installed; install it or unset REDIS_URL.')
+    _redis = redis.Redis.from_url(os.getenv('REDIS_URL'))
+
+class _EvictingSessionCache(TTLCache):
+    """TTLCache that flushes unsaved progress when a session is dropped.
+
+    next_step() coalesces progress writes, so a session can hold a step
+    index the database hasn't seen yet; write it out before the entry
+    disappears.
+    """
+
+    @staticmethod
+    def _flush(learning_session):
+        if (learning_session is not None
+                and learning_session.topic_id is not None
+                and learning_session.current_step_index != learning_session._last_flushed_index):
+            db.update_topic_progress(learning_session.topic_id,
+                                     learning_session.current_step_index)
+
+    def __delitem__(self, key):
+        # Covers explicit deletes and maxsize eviction; TTL expiry goes
+        # through expire() below, which bypasses this override
+        try:
+            # Cache.__getitem__ skips the TTL check, so expired entries
+            # can still be flushed on their way out
+            learning_session = Cache.__getitem__(self, key)
+        except KeyError:
+            learning_session = None
+        super().__delitem__(key)
+        self._flush(learning_session)
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _key, learning_session in expired:
+            self._flush(learning_session)
+        return expired
+
+# In-process fallback when Redis is not configured. Single-worker only;
+# bounded so long-running workers can't leak sessions indefinitely.
+# TTLCache is not thread-safe (and eviction here writes to sqlite
+# mid-mutation), so every access goes through the lock.
+_sessions = _EvictingSessionCache(maxsize=10_000, ttl=SESSION_TTL)
+_sessions_lock = threading.Lock()
+
+def load_session(session_id):
+    """Return the stored LearningSession for this id, or None.
+
+    Reads refresh the TTL, so a session expires after an hour of
+    inactivity rather than an hour after it was last saved - chatting,
+    quizzing and note-taking all keep it alive.
+    """
+    if _redis is not None:
+        data = _redis.getex(f'sess:{session_id}', ex=SESSION_TTL)
+        return pickle.loads(data) if data is not None else None
+    with _sessions_lock:
+        learning_session = _sessions.get(session_id)
+        if learning_session is not None:
+            # re-insert to push the entry's expiry out
+            _sessions[session_id] = learning_session
+        return learning_session
+
+def using_redis():
+    """True when sessions live in Redis rather than the in-process store."""
+    return _redis is not None
+
+def iter_local_sessions():
+    """Return the sessions held by the in-process fallback store."""
+    with _sessions_lock:
+        return list(_sessions.values())
+
+def save_session(session_id, learning_session):
+    """Persist a LearningSession under its id, refreshing the TTL."""
+    if _redis is not None:
+        _redis.set(f'sess:{session_id}', pickle.dumps(learning_session),
+                   ex=SESSION_TTL)
+    else:
+        with _sessions_lock:
+            _sessions[session_id] = learning_session
@@ -1,252 +1,326 @@
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
 DB_PATH = os.getenv('DATABASE_PATH', 'learning_assistant.db')
 
+# One persistent connection per thread, created lazily and reused for the
+# lifetime of the worker. Opening/closing a connection per query was the
+# dominant cost of every db helper under concurrent requests.
+_local = threading.local()
+
+# Bumped on every write that changes the topics listing. Read-side caches
+# key on this counter so they invalidate as soon as a topic is written.
+_topics_version = 0
+
+def topics_version():
+    """Return a counter that changes whenever topic rows are written."""
+    return _topics_version
+
+def _bump_topics_version():
+    global _topics_version
+    _topics_version += 1
+
+def _get_connection():
+    """Return this thread's persistent connection, creating it on first use.
+
+    The connection is re-opened after fork(): sqlite connections must
+    not be used across processes, and under gunicorn --preload this
+    module is imported (and init_db run) in the master before workers
+    are forked.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.conn = sqlite3.connect(DB_PATH)
+        _local.pid = os.getpid()
+    return _local.conn
+
+@contextmanager
+def _transaction():
+    """Yield a cursor on the thread's persistent connection.
+
+    Commits on success, rolls back on error. The connection itself stays
+    open and is reused by subsequent calls.
+    """
+    conn = _get_connection()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Topics table
-    c.execute('''CREATE TABLE IF NOT EXISTS topics
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  name TEXT NOT NULL,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  total_steps INTEGER,
-                  current_step INTEGER DEFAULT 0,
-                  completed BOOLEAN DEFAULT 0,
-                  roadmap_data TEXT)''')
-    
-    # Progress table
-    c.execute('''CREATE TABLE IF NOT EXISTS progress
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  topic_id INTEGER,
-                  step_number INTEGER,
-                  completed BOOLEAN DEFAULT 0,
-                  time_spent INTEGER DEFAULT 0,
-                  completed_at TIMESTAMP,
-                  FOREIGN KEY (topic_id) REFERENCES topics(id))''')
-    
-    # Notes table
-    c.execute('''CREATE TABLE IF NOT EXISTS notes
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  topic_id INTEGER,
-                  step_number INTEGER,
-                  content TEXT,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (topic_id) REFERENCES topics(id))''')
-    
-    # Chat history table
-    c.execute('''CREATE TABLE IF NOT EXISTS chat_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  topic_id INTEGER,
-                  step_number INTEGER,
-                  role TEXT,
-                  message TEXT,
-                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (topic_id) REFERENCES topics(id))''')
-    
-    # Quiz results table
-    c.execute('''CREATE TABLE IF NOT EXISTS quiz_results
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  topic_id INTEGER,
-                  step_number INTEGER,
-                  score INTEGER,
-                  total_questions INTEGER,
-                  completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                  FOREIGN KEY (topic_id) REFERENCES topics(id))''')
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        # Topics table
+        c.execute('''CREATE TABLE IF NOT EXISTS topics
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      name TEXT NOT NULL,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      total_steps INTEGER,
+                      current_step INTEGER DEFAULT 0,
+                      completed BOOLEAN DEFAULT 0,
+                      roadmap_data TEXT)''')
+
+        # Progress table
+        c.execute('''CREATE TABLE IF NOT EXISTS progress
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      topic_id INTEGER,
+                      step_number INTEGER,
+                      completed BOOLEAN DEFAULT 0,
+                      time_spent INTEGER DEFAULT 0,
+                      completed_at TIMESTAMP,
+                      FOREIGN KEY (topic_id) REFERENCES topics(id))''')
+
+        # Notes table
+        c.execute('''CREATE TABLE IF NOT EXISTS notes
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      topic_id INTEGER,
+                      step_number INTEGER,
+                      content TEXT,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (topic_id) REFERENCES topics(id))''')
+
+        # Chat history table
+        c.execute('''CREATE TABLE IF NOT EXISTS chat_history
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      topic_id INTEGER,
+                      step_number INTEGER,
+                      role TEXT,
+                      message TEXT,
+                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (topic_id) REFERENCES topics(id))''')
+
+        # Quiz results table
+        c.execute('''CREATE TABLE IF NOT EXISTS quiz_results
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      topic_id INTEGER,
+                      step_number INTEGER,
+                      score INTEGER,
+                      total_questions INTEGER,
+                      completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                      FOREIGN KEY (topic_id) REFERENCES topics(id))''')
 
 def save_topic(name, roadmap_data, total_steps):
     """Save a new topic to the database"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''INSERT INTO topics (name, total_steps, roadmap_data)
-                 VALUES (?, ?, ?)''', (name, total_steps, json.dumps(roadmap_data)))
-    
-    topic_id = c.lastrowid
-    
-    # Initialize progress for all steps
-    for i in range(total_steps):
-        c.execute('''INSERT INTO progress (topic_id, step_number)
-                     VALUES (?, ?)''', (topic_id, i))
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        c.execute('''INSERT INTO topics (name, total_steps, roadmap_data)
+                     VALUES (?, ?, ?)''', (name, total_steps, json.dumps(roadmap_data)))
+
+        topic_id = c.lastrowid
+
+        # Initialize progress for all steps
+        for i in range(total_steps):
+            c.execute('''INSERT INTO progress (topic_id, step_number)
+                         VALUES (?, ?)''', (topic_id, i))
+
+    _bump_topics_version()
     return topic_id
 
 def get_all_topics():
     """Get all topics"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''SELECT id, name, total_steps, current_step, completed, last_accessed
-                 FROM topics ORDER BY last_accessed DESC''')
-    
-    topics = []
-    for row in c.fetchall():
-        topics.append({
-            'id': row[0],
-            'name': row[1],
-            'total_steps': row[2],
-            'current_step': row[3],
-            'completed': bool(row[4]),
-            'last_accessed': row[5]
-        })
-    
-    conn.close()
+    with _transaction() as c:
+        c.execute('''SELECT id, name, total_steps, current_step, completed, last_accessed
+                     FROM topics ORDER BY last_accessed DESC''')
+
+        topics = []
+        for row in c.fetchall():
+            topics.append({
+                'id': row[0],
+                'name': row[1],
+                'total_steps': row[2],
+                'current_step': row[3],
+                'completed': bool(row[4]),
+                'last_accessed': row[5]
+            })
+
     return topics
 
-def get_topic(topic_id):
-    """Get a specific topic"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
+def _collect_topic(c, topic_id):
     c.execute('''SELECT id, name, total_steps, current_step, roadmap_data
                  FROM topics WHERE id = ?''', (topic_id,))
-    
+
     row = c.fetchone()
-    if row:
-        topic = {
-            'id': row[0],
-            'name': row[1],
-            'total_steps': row[2],
-            'current_step': row[3],
-            'roadmap_data': json.loads(row[4])
-        }
-    else:
-        topic = None
-    
-    conn.close()
-    return topic
+    if row is None:
+        return None
+    return {
+        'id': row[0],
+        'name': row[1],
+        'total_steps': row[2],
+        'current_step': row[3],
+        'roadmap_data': json.loads(row[4])
+    }
+
+def get_topic(topic_id):
+    """Get a specific topic"""
+    with _transaction() as c:
+        return _collect_topic(c, topic_id)
 
 def update_topic_progress(topic_id, step_number):
     """Update the current step for a topic"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''UPDATE topics SET current_step = ?, last_accessed = CURRENT_TIMESTAMP
-                 WHERE id = ?''', (step_number, topic_id))
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        c.execute('''UPDATE topics SET current_step = ?, last_accessed = CURRENT_TIMESTAMP
+                     WHERE id = ?''', (step_number, topic_id))
+    _bump_topics_version()
+
+def update_topics_progress_many(rows):
+    """Batch-update the current step for many topics in one executemany.
+
+    `rows` is a list of (step_number, topic_id) tuples.
+    """
+    with _transaction() as c:
+        c.executemany('''UPDATE topics SET current_step = ?, last_accessed = CURRENT_TIMESTAMP
+                         WHERE id = ?''', rows)
+    _bump_topics_version()
 
 def save_note(topic_id, step_number, content):
     """Save or update a note"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Check if note exists
-    c.execute('''SELECT id FROM notes WHERE topic_id = ? AND step_number = ?''',
-              (topic_id, step_number))
-    
-    if c.fetchone():
-        c.execute('''UPDATE notes SET content = ?, updated_at = CURRENT_TIMESTAMP
-                     WHERE topic_id = ? AND step_number = ?''',
-                  (content, topic_id, step_number))
-    else:
-        c.execute('''INSERT INTO notes (topic_id, step_number, content)
-                     VALUES (?, ?, ?)''', (topic_id, step_number, content))
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        # Check if note exists
+        c.execute('''SELECT id FROM notes WHERE topic_id = ? AND step_number = ?''',
+                  (topic_id, step_number))
+
+        if c.fetchone():
+            c.execute('''UPDATE notes SET content = ?, updated_at = CURRENT_TIMESTAMP
+                         WHERE topic_id = ? AND step_number = ?''',
+                      (content, topic_id, step_number))
+        else:
+            c.execute('''INSERT INTO notes (topic_id, step_number, content)
+                         VALUES (?, ?, ?)''', (topic_id, step_number, content))
 
 def get_note(topic_id, step_number):
     """Get a note for a specific step"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''SELECT content FROM notes WHERE topic_id = ? AND step_number = ?''',
-              (topic_id, step_number))
-    
-    row = c.fetchone()
-    note = row[0] if row else None
-    
-    conn.close()
+    with _transaction() as c:
+        c.execute('''SELECT content FROM notes WHERE topic_id = ? AND step_number = ?''',
+                  (topic_id, step_number))
+
+        row = c.fetchone()
+        note = row[0] if row else None
+
     return note
 
+def _collect_notes(c, topic_id):
+    c.execute('''SELECT step_number, content FROM notes WHERE topic_id = ?''',
+              (topic_id,))
+    return {row[0]: row[1] for row in c.fetchall()}
+
+def get_all_notes(topic_id):
+    """Get every note for a topic, keyed by step number"""
+    with _transaction() as c:
+        return _collect_notes(c, topic_id)
+
 def save_chat_message(topic_id, step_number, role, message):
-    """Save a chat message"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''INSERT INTO chat_history (topic_id, step_number, role, message)
-                 VALUES (?, ?, ?, ?)''', (topic_id, step_number, role, message))
-    
-    conn.commit()
-    conn.close()
+    """Save a chat message.
+
+    The timestamp is generated in Python with microsecond precision so
+    messages written within the same second keep their order.
+    """
+    with _transaction() as c:
+        c.execute('''INSERT INTO chat_history (topic_id, step_number, role, message, created_at)
+                     VALUES (?, ?, ?, ?, ?)''',
+                  (topic_id, step_number, role, message,
+                   datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')))
+
+def save_chat_messages(topic_id, step_number, messages):
+    """Save several chat messages in a single batched insert.
+
+    `messages` is a list of (role, message) tuples. Timestamps are
+    generated per-row in Python (not by the database default) so the
+    original ordering survives even when rows land in the same second.
+    """
+    rows = [
+        (topic_id, step_number, role, message,
+         datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'))
+        for role, message in messages
+    ]
+    with _transaction() as c:
+        c.executemany('''INSERT INTO chat_history (topic_id, step_number, role, message, created_at)
+                         VALUES (?, ?, ?, ?, ?)''', rows)
 
 def get_chat_history(topic_id, step_number, limit=10):
     """Get chat history for a step"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''SELECT role, message, created_at FROM chat_history
-                 WHERE topic_id = ? AND step_number = ?
-                 ORDER BY created_at DESC LIMIT ?''',
-              (topic_id, step_number, limit))
-    
-    messages = []
+    with _transaction() as c:
+        c.execute('''SELECT role, message, created_at FROM chat_history
+                     WHERE topic_id = ? AND step_number = ?
+                     ORDER BY created_at DESC LIMIT ?''',
+                  (topic_id, step_number, limit))
+
+        messages = []
+        for row in c.fetchall():
+            messages.append({
+                'role': row[0],
+                'message': row[1],
+                'created_at': row[2]
+            })
+
+    return list(reversed(messages))
+
+def _collect_chat_history(c, topic_id):
+    c.execute('''SELECT step_number, role, message, created_at FROM chat_history
+                 WHERE topic_id = ? ORDER BY created_at''', (topic_id,))
+
+    history = {}
     for row in c.fetchall():
-        messages.append({
-            'role': row[0],
-            'message': row[1],
-            'created_at': row[2]
+        history.setdefault(row[0], []).append({
+            'role': row[1],
+            'message': row[2],
+            'created_at': row[3]
         })
-    
-    conn.close()
-    return list(reversed(messages))
+    return history
+
+def get_all_chat_history(topic_id):
+    """Get every chat message for a topic, grouped by step number"""
+    with _transaction() as c:
+        return _collect_chat_history(c, topic_id)
 
 def clear_chat_history(topic_id, step_number):
     """Clear chat history for a specific step"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''DELETE FROM chat_history 
-                 WHERE topic_id = ? AND step_number = ?''',
-              (topic_id, step_number))
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        c.execute('''DELETE FROM chat_history
+                     WHERE topic_id = ? AND step_number = ?''',
+                  (topic_id, step_number))
+
+def get_export_bundle(topic_id):
+    """Get a topic plus all its notes and chat history in one transaction.
+
+    Returns (topic, notes, history) where notes and history are keyed by
+    step number, or (None, {}, {}) if the topic does not exist. Running
+    the three selects back-to-back on the same cursor means /api/export
+    pays for a single transaction instead of three.
+    """
+    with _transaction() as c:
+        topic = _collect_topic(c, topic_id)
+        if topic is None:
+            return None, {}, {}
+        return topic, _collect_notes(c, topic_id), _collect_chat_history(c, topic_id)
 
 def save_quiz_result(topic_id, step_number, score, total_questions):
     """Save quiz results"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''INSERT INTO quiz_results (topic_id, step_number, score, total_questions)
-                 VALUES (?, ?, ?, ?)''', (topic_id, step_number, score, total_questions))
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        c.execute('''INSERT INTO quiz_results (topic_id, step_number, score, total_questions)
+                     VALUES (?, ?, ?, ?)''', (topic_id, step_number, score, total_questions))
 
 def get_quiz_results(topic_id):
     """Get all quiz results for a topic"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''SELECT step_number, score, total_questions, completed_at
-                 FROM quiz_results WHERE topic_id = ?
-                 ORDER BY step_number''', (topic_id,))
-    
-    results = []
-    for row in c.fetchall():
-        results.append({
-            'step_number': row[0],
-            'score': row[1],
-            'total_questions': row[2],
-            'completed_at': row[3]
-        })
-    
-    conn.close()
+    with _transaction() as c:
+        c.execute('''SELECT step_number, score, total_questions, completed_at
+                     FROM quiz_results WHERE topic_id = ?
+                     ORDER BY step_number''', (topic_id,))
+
+        results = []
+        for row in c.fetchall():
+            results.append({
+                'step_number': row[0],
+                'score': row[1],
+                'total_questions': row[2],
+                'completed_at': row[3]
+            })
+
     return results
 
 # Initialize database on import
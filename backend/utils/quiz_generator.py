@@ -84,3 +84,14 @@ Make questions practical and test real understanding, not just memorization."""
     def check_answer(self, question, user_answer):
         """Check if the user's answer is correct"""
         return user_answer.upper() == question['correct'].upper()
+
+    def check_answers_batch(self, questions, user_answers):
+        """Check a whole quiz in one pass; returns one bool per question.
+
+        Unanswered questions count as incorrect, as do questions whose
+        correct answer failed to parse. Normalizing both sides up front
+        avoids repeating the per-question work of check_answer in a loop.
+        """
+        corrects = [q['correct'].upper() if q.get('correct') else None for q in questions]
+        normalized = [a.upper() if a else None for a in user_answers]
+        return [u is not None and u == c for u, c in zip(normalized, corrects)]